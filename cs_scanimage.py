@@ -37,62 +37,251 @@ MMMMMMMMMMM
 """
 from __future__ import print_function
 import argparse
+import collections
+import hashlib
 import json
 import logging
+import math
+import os
+import queue
+import random
+import shutil
 import sys
 from os import environ as env
 from enum import Enum
 import subprocess  # nosec
+import tempfile
+import threading
 import time
 import getpass
-from falconpy import FalconContainer, ContainerBaseURL
-
-try:
-    import docker
-except ModuleNotFoundError:
-    import podman as docker
+from types import MappingProxyType
 
 logging.basicConfig(stream=sys.stdout, format="%(levelname)-8s%(message)s")
 log = logging.getLogger("cs_scanimage")
 
 VERSION = "2.0.1"
 
-
-class ScanImage(Exception):
+Region = collections.namedtuple("Region", ["server_domain", "base_url"])
+
+# registry and API endpoints of each CrowdStrike cloud region
+REGIONS = MappingProxyType(
+    {
+        "us-1": Region(
+            "container-upload.us-1.crowdstrike.com", "https://api.crowdstrike.com"
+        ),
+        "us-2": Region(
+            "container-upload.us-2.crowdstrike.com",
+            "https://api.us-2.crowdstrike.com",
+        ),
+        "eu-1": Region(
+            "container-upload.eu-1.crowdstrike.com",
+            "https://api.eu-1.crowdstrike.com",
+        ),
+        "us-gov-1": Region(
+            "container-upload.laggar.gcw.crowdstrike.com",
+            "https://api.laggar.gcw.crowdstrike.com",
+        ),
+    }
+)
+
+# shared read-only default for missing nested report fields
+_EMPTY = {}
+
+CACHE_DIR = os.path.join(
+    env.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")),
+    "cs_scanimage",
+)
+TOKEN_CACHE_DIR = os.path.join(CACHE_DIR, "tokens")
+REPORT_CACHE_DIR = os.path.join(CACHE_DIR, "reports")
+
+
+class ScanImage(Exception):  # pylint: disable=too-many-instance-attributes
     """Scanning Image Tasks"""
 
-    def __init__(self, client_id, client_secret, repo, tag, client, cloud, useragent):
+    retry_growth = 1.6
+    retry_jitter = 1.0
+    # upper bound on a server supplied Retry-After, unless retry_cap is higher
+    retry_after_max = 300
+    progress_interval = 0.25
+    # report poll statuses that no amount of retrying will fix; 404 is not
+    # among them, as it is returned until the report has been generated
+    terminal_status = (400, 401, 403)
+
+    def __init__(
+        self,
+        client_id,
+        client_secret,
+        repo,
+        tag,
+        client,
+        cloud,
+        useragent,
+        token_cache=True,
+    ):
         self.client_id = client_id
         self.client_secret = client_secret
         self.repo = repo
         self.tag = tag
         self.client = client
-        self.falcon = FalconContainer(
-            client_id=client_id,
-            client_secret=client_secret,
-            base_url=cloud,
-            user_agent=useragent,
+        self.cloud = cloud
+        self.useragent = useragent
+        # one cache file per API client and cloud, so that jobs using other
+        # credentials on the same runner do not evict each other's token
+        self.token_cache = None
+        if token_cache:
+            key = hashlib.sha256("\0".join((client_id, cloud)).encode()).hexdigest()
+            self.token_cache = os.path.join(TOKEN_CACHE_DIR, key + ".json")
+        # token_time of the token last read from or written to the cache
+        self.token_time = None
+        self.token_cached = False
+        self.session = None
+        self._falcon = None
+        self.server_domain = REGIONS[cloud].server_domain
+        # podman CLI login, used when the podman python client cannot log in
+        self.podman_login = [
+            shutil.which("podman") or "/usr/bin/podman",
+            "login",
+            "--username",
+            client_id,
+            "--password",
+            client_secret,
+            self.server_domain,
+        ]
+
+    # the API client is only set up once it is needed, so a cached scan
+    # report is evaluated without authenticating to the API
+    @property
+    def falcon(self):
+        if self._falcon is None:
+            self._falcon = self._connect()
+            self._save_token()
+        return self._falcon
+
+    def _connect(self):
+        # the API client libraries are slow to import, so --help and argument
+        # errors do not pay for them
+        # pylint: disable=import-outside-toplevel
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        from falconpy import FalconContainer, OAuth2
+
+        # one keep-alive session shared by the token request and every poll;
+        # urllib3 only retries connection errors, throttling and server errors
+        # are left to the poll loop so its backoff and Retry-After clamp apply
+        self.session = requests.Session()
+        self.session.mount(
+            "https://",
+            HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=4,
+                max_retries=Retry(
+                    total=5,
+                    backoff_factor=1,
+                    respect_retry_after_header=False,
+                    raise_on_status=False,
+                ),
+            ),
         )
-        self.server_domain = ContainerBaseURL[cloud.replace("-", "").upper()].value
+        # ask for JSON explicitly; compression needs no header of ours, as
+        # requests already sends Accept-Encoding for gzip and deflate (and br
+        # when brotli is installed) and decodes responses transparently
+        self.session.headers["Accept"] = "application/json"
+        auth = OAuth2(
+            client_id=self.client_id,
+            client_secret=self.client_secret,
+            base_url=REGIONS[self.cloud].base_url,
+            user_agent=self.useragent,
+            session=self.session,
+        )
+        self._load_token(auth)
+        # FalconContainer only requests a new token when none was loaded
+        return FalconContainer(auth_object=auth, user_agent=self.useragent)
+
+    # reuse the bearer token of a previous run while it is still valid, i.e.
+    # not yet within the window in which FalconPy would renew it anyway
+    def _load_token(self, auth):
+        cached = read_cache(self.token_cache) if self.token_cache else None
+        if not cached:
+            return
+        remaining = cached.get("expiry_epoch", 0) - time.time()
+        if remaining <= auth.renew_window:
+            return
+        log.debug("Reusing cached API token")
+        auth.token_value = cached["token"]
+        auth.token_expiration = int(remaining)
+        auth.token_time = time.time()
+        auth.token_status = 201
+        self.token_time = auth.token_time
+        self.token_cached = True
+
+    # persist the current token if FalconPy obtained a new one since the
+    # cache was last read or written
+    def _save_token(self):
+        auth = self.falcon.auth_object
+        if not self.token_cache or auth.token_status != 201:
+            return
+        if auth.token_time == self.token_time:
+            return
+        self.token_time = auth.token_time
+        write_cache(
+            self.token_cache,
+            {
+                "token": auth.token_value,
+                "expiry_epoch": auth.token_time + auth.token_expiration,
+            },
+        )
+
+    # scan reports are cached per image content digest, so an unchanged image
+    # is not pushed and scanned again while its cached report is fresh
+    def _report_cache_path(self):
+        local_tag = "%s:%s" % (self.repo, self.tag)
+        try:
+            image_id = self.client.images.get(local_tag).id
+        except container_sdk().errors.ImageNotFound:
+            return None
+        # reports are per tenant and region: another client or cloud must
+        # still get the image pushed and assessed
+        key = hashlib.sha256(
+            "\0".join(
+                (image_id, self.repo, self.tag, self.server_domain, self.client_id)
+            ).encode()
+        ).hexdigest()
+        return os.path.join(REPORT_CACHE_DIR, key + ".json")
+
+    def cached_report(self, ttl):
+        if ttl <= 0:
+            return None
+        path = self._report_cache_path()
+        if path is None:
+            return None
+        try:
+            age = time.time() - os.path.getmtime(path)
+        except OSError:
+            return None
+        report = read_cache(path) if age < ttl else None
+        if report is None:
+            return None
+        log.info("Using scan report cached %d seconds ago", age)
+        return ScanReport(report)
+
+    def cache_report(self, scan_report):
+        path = self._report_cache_path()
+        if path is not None:
+            write_cache(path, scan_report)
 
     # Step 1: perform container tag to the registry corresponding to the cloud entered
     def container_tag(self):
         local_tag = "%s:%s" % (self.repo, self.tag)
         url_tag = "%s/%s" % (self.server_domain, self.repo)
 
-        container_image = "".join(
-            (
-                "".join(img.attrs["RepoTags"])
-                for img in self.client.images.list(filters={"reference": local_tag})
-            )
-        )
-
-        if not container_image:
+        images = self.client.images
+        if not images.list(filters={"reference": local_tag}):
             log.info("Pulling container image: '%s'", local_tag)
-            self.client.images.pull(local_tag)
+            images.pull(local_tag)
 
         log.info("Tagging '%s' to '%s:%s'", local_tag, url_tag, self.tag)
-        self.client.images.get(local_tag).tag(url_tag, self.tag, force=True)
+        images.get(local_tag).tag(url_tag, self.tag, force=True)
 
     # Step 2: login using the credentials supplied
     def container_login(self):
@@ -106,22 +295,18 @@ class ScanImage(Exception):
         try:
             log.info(login["Status"])
         except TypeError:
-            command = ["/usr/bin/podman", "login"]
-            command.extend(["--username", self.client_id])
-            command.extend(["--password", self.client_secret])
-            command.append(self.server_domain)
             result = subprocess.run(
-                command,
+                self.podman_login,
                 shell=False,
                 encoding="utf-8",  # nosec
-                stdout=subprocess.PIPE,
+                stdout=subprocess.DEVNULL,
                 stderr=subprocess.PIPE,
-                check=True,
+                check=False,
             )
             if result.returncode != 0:
                 raise RuntimeError(result.stderr.strip()) from None
 
-            log.info(result.stdout.strip())
+            log.info("Login Succeeded!")
 
     # Step 3: perform container push using the repo and tag supplied
     def container_push(self):
@@ -133,41 +318,118 @@ class ScanImage(Exception):
         except AttributeError:
             image_push = self.client.push(image_str, stream=True, decode=True)
 
-        for line in image_push:
+        # progress is redrawn at most every progress_interval seconds, and only
+        # on a terminal; otherwise the per-layer status lines are enough
+        show_progress = sys.stdout.isatty()
+        last_progress = 0.0
+        for line in prefetch(image_push):
             if "error" in line:
                 raise APIError("docker_push " + line["error"])
 
             if "status" in line and line["status"] == "Pushing":
-                print(
-                    "Pushing {}".format(
-                        [line.get(key) for key in ["progress", "progressDetails"]]
-                    ),
-                    end="\r",
-                )
+                now = time.monotonic()
+                if show_progress and now - last_progress >= self.progress_interval:
+                    print(
+                        "Pushing {}".format(
+                            [line.get(key) for key in ["progress", "progressDetails"]]
+                        ),
+                        end="\r",
+                    )
+                    last_progress = now
             elif "status" in line:
                 log.info("Docker: %s", line["status"])
             else:
                 log.debug(line)
 
-    # Step 4: poll and get scanreport for specified amount of retries
-    def get_scanreport(self, retry_count):
+    # Step 4: wait for the scan to warm up, then poll and get scanreport
+    # for specified amount of retries, backing off exponentially between polls
+    def get_scanreport(self, retry_count, retry_base, retry_cap, initial_delay):
         log.info("Downloading Image Scan Report")
-        sleep_seconds = 10
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(
+                "Waiting at most %.0f seconds for the scan report",
+                initial_delay
+                + sum(
+                    self._backoff(attempt, retry_base, retry_cap)
+                    for attempt in range(retry_count - 1)
+                ),
+            )
+        try:
+            return self._poll_scanreport(
+                retry_count, retry_base, retry_cap, initial_delay
+            )
+        finally:
+            # the token may have been renewed during a long poll
+            self._save_token()
+
+    def _poll_scanreport(self, retry_count, retry_base, retry_cap, initial_delay):
+        sleep_seconds = initial_delay
         for count in range(retry_count):
             time.sleep(sleep_seconds)
             log.debug("retry count %s", count)
-            resp = self.falcon.get_assessment(repository=self.repo, tag=self.tag)
-            if resp["status_code"] != 200:
-                log.info(
-                    "Scan report is not ready yet, retrying in %s seconds",
-                    sleep_seconds,
-                )
-            else:
+            # the assessment endpoint has no HEAD or status-only variant, but
+            # until the report exists it answers with a small error body, so
+            # only the final poll transfers the full report
+            resp = self._get_assessment()
+            if resp["status_code"] == 200:
                 return ScanReport(resp["body"])
+            if resp["status_code"] in self.terminal_status:
+                log.error(
+                    "Scan report request failed with status %s: %.500s",
+                    resp["status_code"],
+                    resp.get("body"),
+                )
+                raise APIError(resp["status_code"])
+            sleep_seconds = self._retry_delay(count, retry_base, retry_cap, resp)
+            log.info(
+                "Scan report is not ready yet, retrying in %.1f seconds",
+                sleep_seconds,
+            )
         raise RetryExhaustedError(
             f"Report was not completed after {retry_count} retries. Use -R or --retry_count to increase the number of retries"
         )
 
+    # a cached token may since have been revoked or lack newly granted scopes,
+    # so when the API rejects one, drop it and retry once with a fresh token
+    def _get_assessment(self):
+        resp = self.falcon.get_assessment(repository=self.repo, tag=self.tag)
+        if resp["status_code"] in (401, 403) and self.token_cached:
+            log.info("Cached API token was rejected, requesting a new one")
+            self.token_cached = False
+            try:
+                os.remove(self.token_cache)
+            except OSError:
+                pass
+            self.falcon.login()
+            self._save_token()
+            resp = self.falcon.get_assessment(repository=self.repo, tag=self.tag)
+        return resp
+
+    # delay before the next poll: honor the server's Retry-After when throttled
+    # (within reason), otherwise back off exponentially with a little jitter
+    def _retry_delay(self, attempt, retry_base, retry_cap, resp=None):
+        if resp is not None and resp["status_code"] in (429, 503):
+            retry_after = resp.get("headers", {}).get("Retry-After")
+            try:
+                return min(
+                    max(float(retry_after), 0), max(retry_cap, self.retry_after_max)
+                )
+            except (TypeError, ValueError):
+                pass
+        delay = self._backoff(attempt, retry_base, retry_cap)
+        return delay + random.uniform(0, self.retry_jitter)  # nosec
+
+    # exponential delay capped at retry_cap; the exponent stops growing once
+    # the cap is reached, so large attempt numbers cannot overflow
+    def _backoff(self, attempt, retry_base, retry_cap):
+        if 0 < retry_base < retry_cap:
+            attempt = min(
+                attempt, math.ceil(math.log(retry_cap / retry_base, self.retry_growth))
+            )
+        else:
+            attempt = 0
+        return min(retry_cap, retry_base * self.retry_growth**attempt)
+
 
 class ScanReport(dict):
     """Summary Report of the Image Scan"""
@@ -177,11 +439,21 @@ class ScanReport(dict):
     detect_str_key = "Detections"
 
     severity_high = "high"
+    severity_scores = {"low": 20, "medium": 100, "high": 500, "critical": 2000}
     type_malware = "malware"
     type_secret = "secret"  # nosec
     type_misconfig = "misconfiguration"
     type_cis = "cis"
 
+    # no per-instance __dict__: the only instance state is the memoized
+    # results of walking the report, computed on first use
+    __slots__ = ("_vuln_score", "_detections")
+
+    def __init__(self, *args, **kwargs):
+        super(ScanReport, self).__init__(*args, **kwargs)
+        self._vuln_score = None
+        self._detections = None
+
     def status_code(self):
         vuln_code = self.get_alerts_vuln()
         mal_code = self.get_alerts_malware()
@@ -189,19 +461,24 @@ class ScanReport(dict):
         mcfg_code = self.get_alerts_misconfig()
         return vuln_code | mal_code | sec_code | mcfg_code
 
+    # json.dump streams the encoding to the file instead of building one
+    # string, bounding memory use on large reports
     def export(self, filename):
         with open(filename, "w", encoding="utf-8") as f:
-            f.write(json.dumps(self, indent=4))
+            json.dump(self, f, indent=4)
 
     # Step 5: pass the vulnerabilities from scan report,
     # loop through and find high severity vulns
     # return HighVulnerability enum value
     def get_alerts_vuln(self):
         log.info("Searching for vulnerabilities in scan report...")
-        critical_score = 2000
-        high_score = 500
-        medium_score = 100
-        low_score = 20
+        if self._vuln_score is None:
+            self._vuln_score = self._score_vulnerabilities()
+        return self._vuln_score
+
+    def _score_vulnerabilities(self):
+        severity_scores = self.severity_scores
+        log_warning = log.warning
         vuln_score = 0
         vulnerabilities = self[self.vuln_str_key_1]
         if vulnerabilities is not None:
@@ -223,77 +500,65 @@ class ScanReport(dict):
 
                 product = vuln.get("Product", {})
                 affects = product.get("PackageSource", product)
-                log.warning(
+                log_warning(
                     "%-8s %-16s Vulnerability detected affecting %s",
                     severity,
                     cve,
                     affects,
                 )
-                if severity.lower() == "low":
-                    vuln_score = vuln_score + low_score
-                if severity.lower() == "medium":
-                    vuln_score = vuln_score + medium_score
-                if severity.lower() == "high":
-                    vuln_score = vuln_score + high_score
-                if severity.lower() == "critical":
-                    vuln_score = vuln_score + critical_score
+                vuln_score += severity_scores.get(severity.lower(), 0)
         return vuln_score
 
-    # Step 6: pass the detections from scan report,
-    # loop through and find if detection type is malware
+    # walk the detections once, flagging whether malware, secrets
+    # and misconfigurations were found
+    def _scan_detections(self):
+        if self._detections is None:
+            malware = secret = misconfig = False
+            type_malware = self.type_malware
+            type_secret = self.type_secret
+            types_misconfig = (self.type_misconfig, self.type_cis)
+            detections = self[self.detect_str_key]
+            for detection in detections if detections is not None else ():
+                det_type = detection.get("Detection", _EMPTY).get("Type", "").lower()
+                if det_type == type_malware:
+                    malware = True
+                elif det_type == type_secret:
+                    secret = True
+                elif det_type in types_misconfig:
+                    misconfig = True
+                if malware and secret and misconfig:
+                    break
+            self._detections = (malware, secret, misconfig)
+        return self._detections
+
+    # Step 6: find if any detection type is malware
     # return Malware enum value
     def get_alerts_malware(self):
         log.info("Searching for malware in scan report...")
         det_code = 0
-        detections = self[self.detect_str_key]
-        if detections is not None:
-            for detection in detections:
-                try:
-                    if detection["Detection"]["Type"].lower() == self.type_malware:
-                        log.warning("Alert: Malware found")
-                        det_code = ScanStatusCode.Malware.value
-                        break
-                except KeyError:
-                    continue
+        if self._scan_detections()[0]:
+            log.warning("Alert: Malware found")
+            det_code = ScanStatusCode.Malware.value
         return det_code
 
-    # Step 7: pass the detections from scan report,
-    # loop through and find if detection type is secret
-    # return Success enum value
+    # Step 7: find if any detection type is secret
+    # return Secrets enum value
     def get_alerts_secrets(self):
         log.info("Searching for leaked secrets in scan report...")
         det_code = 0
-        detections = self[self.detect_str_key]
-        if detections is not None:
-            for detection in detections:
-                try:
-                    if detection["Detection"]["Type"].lower() == self.type_secret:
-                        log.error("Alert: Leaked secrets detected")
-                        det_code = ScanStatusCode.Secrets.value
-                        break
-                except KeyError:
-                    continue
+        if self._scan_detections()[1]:
+            log.error("Alert: Leaked secrets detected")
+            det_code = ScanStatusCode.Secrets.value
         return det_code
 
-    # Step 8: pass the detections from scan report,
-    # loop through and find if detection type is misconfig
+    # Step 8: find if any detection type is misconfig
     # return Success enum value
     def get_alerts_misconfig(self):
         log.info("Searching for misconfigurations in scan report...")
         det_code = 0
-        detections = self[self.detect_str_key]
-        if detections is not None:
-            for detection in detections:
-                try:
-                    if detection["Detection"]["Type"].lower() in [
-                        self.type_misconfig,
-                        self.type_cis,
-                    ]:
-                        log.warning("Alert: Misconfiguration found")
-                        det_code = ScanStatusCode.Success.value
-                        break
-                except KeyError:
-                    continue
+        if self._scan_detections()[2]:
+            log.warning("Alert: Misconfiguration found")
+            det_code = ScanStatusCode.Success.value
         return det_code
 
 
@@ -323,12 +588,68 @@ class RetryExhaustedError(Exception):
     """Raised when get report retries are exhausted"""
 
 
+# the docker SDK (or podman's docker-compatible bindings) is slow to import,
+# so it is only imported once a container engine is actually needed
+def container_sdk():
+    try:
+        import docker  # pylint: disable=import-outside-toplevel
+    except ModuleNotFoundError:
+        import podman as docker  # pylint: disable=import-outside-toplevel
+    return docker
+
+
+# consume a blocking iterator on a background thread, so that e.g. the push
+# stream is read as fast as it arrives however long the caller takes per item
+def prefetch(iterable, maxsize=64):
+    items = queue.Queue(maxsize=maxsize)
+    errors = []
+    done = object()
+
+    def drain():
+        try:
+            for item in iterable:
+                items.put(item)
+        except Exception as err:  # pylint: disable=broad-except
+            errors.append(err)
+        finally:
+            items.put(done)
+
+    threading.Thread(target=drain, daemon=True).start()
+    yield from iter(items.get, done)
+    if errors:
+        raise errors[0]
+
+
+# cache files hold credentials and reports: failures to read or write them
+# are never fatal, and they are only ever readable by the current user
+def read_cache(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_cache(path, data):
+    tmp = None
+    try:
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        os.chmod(tmp, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+    except OSError as err:
+        log.debug("Unable to write cache file %s: %s", path, err)
+        if tmp and os.path.exists(tmp):
+            os.unlink(tmp)
+
+
 # The following class was authored by Russell Heilling
 # See https://stackoverflow.com/questions/10551117/setting-options-from-environment-variables-when-using-argparse/10551190#10551190
 class EnvDefault(argparse.Action):
     def __init__(self, envvar, required=True, default=None, **kwargs):
-        if envvar in env:
-            default = env[envvar]
+        default = env.get(envvar, default)
         if required and default:
             required = False
         super(EnvDefault, self).__init__(default=default, required=required, **kwargs)
@@ -340,6 +661,20 @@ class EnvDefault(argparse.Action):
 # End code authored by Russell Heilling
 
 
+def positive_float(value):
+    number = float(value)
+    if not math.isfinite(number) or number <= 0:
+        raise argparse.ArgumentTypeError("%r is not a positive number" % value)
+    return number
+
+
+def non_negative_float(value):
+    number = float(value)
+    if not math.isfinite(number) or number < 0:
+        raise argparse.ArgumentTypeError("%r is not a non-negative number" % value)
+    return number
+
+
 def parse_args():
     parser = argparse.ArgumentParser(formatter_class=argparse.RawTextHelpFormatter)
     required = parser.add_argument_group("required arguments")
@@ -375,7 +710,7 @@ def parse_args():
         dest="cloud",
         envvar="FALCON_CLOUD_REGION",
         default="us-1",
-        choices=["us-1", "us-2", "eu-1", "us-gov-1"],
+        choices=tuple(REGIONS),
         help="CrowdStrike cloud region",
     )
     required.add_argument(
@@ -403,7 +738,7 @@ def parse_args():
         envvar="LOG_LEVEL",
         default="INFO",
         required=False,
-        choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
+        choices=("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"),
         help="Set the logging level",
     )
     required.add_argument(
@@ -411,10 +746,74 @@ def parse_args():
         "--retry_count",
         action=EnvDefault,
         dest="retry_count",
-        default="100",
+        default="20",
         envvar="RETRY_COUNT",
         type=int,
-        help="Scan report retry count",
+        help="Maximum number of scan report polls",
+    )
+    parser.add_argument(
+        "--retry-base",
+        action=EnvDefault,
+        dest="retry_base",
+        default="5",
+        envvar="RETRY_BASE",
+        required=False,
+        type=positive_float,
+        help="Initial delay in seconds between scan report polls",
+    )
+    parser.add_argument(
+        "--retry-cap",
+        action=EnvDefault,
+        dest="retry_cap",
+        default="60",
+        envvar="RETRY_CAP",
+        required=False,
+        type=positive_float,
+        help="Maximum delay in seconds between scan report polls",
+    )
+    parser.add_argument(
+        "--initial-delay",
+        action=EnvDefault,
+        dest="initial_delay",
+        default="60",
+        envvar="INITIAL_DELAY",
+        required=False,
+        type=non_negative_float,
+        help="Seconds to wait for the scan before the first scan report poll",
+    )
+    parser.add_argument(
+        "--no-warmup",
+        action="store_true",
+        default=False,
+        dest="no_warmup",
+        required=False,
+        help="Poll for the scan report immediately, ignoring --initial-delay",
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        action=EnvDefault,
+        dest="cache_ttl",
+        default="43200",
+        envvar="CACHE_TTL",
+        required=False,
+        type=int,
+        help="Seconds a cached scan report of an unchanged image is reused",
+    )
+    parser.add_argument(
+        "--force-scan",
+        action="store_true",
+        default=False,
+        dest="force_scan",
+        required=False,
+        help="Push and scan the image even if a cached scan report exists",
+    )
+    parser.add_argument(
+        "--no-token-cache",
+        action="store_true",
+        default=False,
+        dest="no_token_cache",
+        required=False,
+        help="Do not read or write the API token cache",
     )
     parser.add_argument(
         "--plugin",
@@ -433,6 +832,8 @@ def parse_args():
     )
 
     args = parser.parse_args()
+    if args.retry_cap < args.retry_base:
+        parser.error("--retry-cap must not be less than --retry-base")
     logging.getLogger().setLevel(args.log_level)
 
     return (
@@ -443,6 +844,11 @@ def parse_args():
         args.score,
         args.report,
         args.retry_count,
+        args.retry_base,
+        args.retry_cap,
+        0 if args.no_warmup else args.initial_delay,
+        0 if args.force_scan else args.cache_ttl,
+        not args.no_token_cache,
         args.plugin,
         args.useragent,
     )
@@ -458,23 +864,40 @@ def main():
             score,
             json_report,
             retry_count,
+            retry_base,
+            retry_cap,
+            initial_delay,
+            cache_ttl,
+            token_cache,
             plugin,
             useragent,
         ) = parse_args()
-        client = docker.from_env()
+        client = container_sdk().from_env()
         client_secret = env.get("FALCON_CLIENT_SECRET")
         if client_secret is None:
             print("Please enter your Falcon OAuth2 API Secret")
             client_secret = getpass.getpass()
         useragent = "%s/%s" % (useragent, VERSION)
         scan_image = ScanImage(
-            client_id, client_secret, repo, tag, client, cloud, useragent
+            client_id,
+            client_secret,
+            repo,
+            tag,
+            client,
+            cloud,
+            useragent,
+            token_cache=token_cache,
         )
-        scan_image.container_tag()
-        scan_image.container_login()
-        scan_image.container_push()
-
-        scan_report = scan_image.get_scanreport(retry_count)
+        scan_report = scan_image.cached_report(cache_ttl)
+        if scan_report is None:
+            scan_image.container_tag()
+            scan_image.container_login()
+            scan_image.container_push()
+
+            scan_report = scan_image.get_scanreport(
+                retry_count, retry_base, retry_cap, initial_delay
+            )
+            scan_image.cache_report(scan_report)
 
         if plugin:
             print(json.dumps(scan_report, indent=4))
@@ -482,31 +905,33 @@ def main():
 
         if json_report:
             scan_report.export(json_report)
-        f_vuln_score = int(scan_report.get_alerts_vuln())
-        f_secrets = int(scan_report.get_alerts_secrets())
-        f_malware = int(scan_report.get_alerts_malware())
-        scan_report.get_alerts_misconfig()
 
-        if f_secrets == ScanStatusCode.Secrets.value:
+        # secrets and malware fail the scan outright, so check them before
+        # scoring every vulnerability
+        if scan_report.get_alerts_secrets():
             log.error("Exiting: Secrets found in container image")
-            sys.exit(ScanStatusCode.Secrets.value)
-        if f_malware == ScanStatusCode.Malware.value:
+            exit_code = ScanStatusCode.Secrets.value
+        elif scan_report.get_alerts_malware():
             log.error("Exiting: Malware found in container image")
-            sys.exit(ScanStatusCode.Malware.value)
-        if f_vuln_score >= int(score):
-            log.error(
-                "Exiting: Vulnerability score threshold exceeded: '%s' out of '%s'",
-                f_vuln_score,
-                score,
-            )
-            sys.exit(ScanStatusCode.Vulnerability.value)
+            exit_code = ScanStatusCode.Malware.value
         else:
-            log.info(
-                "Vulnerability score threshold not met: '%s' out of '%s'",
-                f_vuln_score,
-                score,
-            )
-            sys.exit(ScanStatusCode.Success.value)
+            f_vuln_score = scan_report.get_alerts_vuln()
+            scan_report.get_alerts_misconfig()
+            if f_vuln_score >= int(score):
+                log.error(
+                    "Exiting: Vulnerability score threshold exceeded: '%s' out of '%s'",
+                    f_vuln_score,
+                    score,
+                )
+                exit_code = ScanStatusCode.Vulnerability.value
+            else:
+                log.info(
+                    "Vulnerability score threshold not met: '%s' out of '%s'",
+                    f_vuln_score,
+                    score,
+                )
+                exit_code = ScanStatusCode.Success.value
+        sys.exit(exit_code)
 
     except APIError:
         log.exception("Unable to scan")
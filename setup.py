@@ -21,9 +21,13 @@ setup(
     include_package_data=True,
     install_requires=[
         'docker',
-        'crowdstrike-falconpy'
+        'crowdstrike-falconpy',
+        'requests',
     ],
     extras_require={
+        'speedups': [
+            'brotli',
+        ],
         'devel': [
             'flake8',
             'pylint',